@@ -1,40 +1,95 @@
 """FastAPI application for sci.platformai.org authentication."""
 
-import urllib.parse
+import asyncio
 import logging
+import sqlite3
+from contextlib import asynccontextmanager
+from typing import Annotated
 
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.responses import HTMLResponse, ORJSONResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
-from starlette.middleware.cors import CORSMiddleware
+from pydantic import BaseModel, Field, StringConstraints
 
 from auth import (
-    SSO_REDIRECT_URL,
-    SSO_CALLBACK_URL,
+    JWT_EXPIRY,
+    SSO_LOGIN_URL,
+    close_sso_client,
     create_jwt,
     exchange_sso_token,
     get_current_user,
     hash_password,
+    invalidate_jwt,
+    password_needs_rehash,
+    verify_password,
 )
-from database import init_db, get_db, upsert_user, get_user
+from database import (
+    init_db,
+    create_local_user,
+    upsert_user,
+    set_password_hash,
+    open_pool,
+    close_pool,
+    db_fetchall,
+    db_run,
+)
+from middleware import SciCORS
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="AI Science Auth", docs_url=None, redoc_url=None)
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["https://sci.platformai.org"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create the schema and open the DB pool; release resources on shutdown."""
+    await asyncio.to_thread(init_db)
+    open_pool()
+    yield
+    close_pool()
+    await close_sso_client()
+
+
+app = FastAPI(
+    title="AI Science Auth",
+    lifespan=lifespan,
+    docs_url=None,
+    redoc_url=None,
+    default_response_class=ORJSONResponse,
 )
 
+app.add_middleware(SciCORS)
+
 templates = Jinja2Templates(directory="templates")
+templates.env.auto_reload = False
+
+
+# ---------------------------------------------------------------------------
+# Request bodies
+# ---------------------------------------------------------------------------
+Username = Annotated[str, StringConstraints(strip_whitespace=True, min_length=1)]
 
-# Initialize database on startup
-init_db()
+
+class LoginIn(BaseModel):
+    username: Username
+    password: str = Field(min_length=1)
+
+
+class RegisterIn(BaseModel):
+    username: Username
+    password: str = Field(min_length=8)
+
+
+# ---------------------------------------------------------------------------
+# Session cookie
+# ---------------------------------------------------------------------------
+_SESSION_COOKIE_ATTRS = f"; HttpOnly; SameSite=Lax; Max-Age={JWT_EXPIRY}; Path=/".encode()
+
+
+def _attach_session_cookie(response, jwt_token: str) -> None:
+    """Set the sci_token cookie without going through Starlette's SimpleCookie."""
+    response.raw_headers.append(
+        (b"set-cookie", b"sci_token=" + jwt_token.encode() + _SESSION_COOKIE_ATTRS)
+    )
 
 
 # ---------------------------------------------------------------------------
@@ -42,9 +97,8 @@ init_db()
 # ---------------------------------------------------------------------------
 @app.get("/login", response_class=HTMLResponse)
 async def login_page(request: Request, error: str = ""):
-    sso_url = f"{SSO_REDIRECT_URL}?redirect={urllib.parse.quote(SSO_CALLBACK_URL)}"
     return templates.TemplateResponse(
-        "login.html", {"request": request, "sso_url": sso_url, "error": error}
+        "login.html", {"request": request, "sso_url": SSO_LOGIN_URL, "error": error}
     )
 
 
@@ -68,22 +122,11 @@ async def sso_callback(
     if not user_info or not user_info.get("user_id"):
         return RedirectResponse("/login?error=SSO+validation+failed")
 
-    upsert_user(user_info, tok)
+    await db_run(upsert_user, user_info, tok)
 
-    jwt_token = create_jwt(
-        user_info["user_id"],
-        user_info.get("user_name", ""),
-        user_info.get("role", "user"),
-    )
+    jwt_token = create_jwt(user_info["user_id"], user_info.get("role", "user"))
     response = RedirectResponse("/", status_code=302)
-    response.set_cookie(
-        "sci_token",
-        jwt_token,
-        httponly=True,
-        samesite="lax",
-        max_age=60 * 60 * 24 * 7,
-        path="/",
-    )
+    _attach_session_cookie(response, jwt_token)
     return response
 
 
@@ -91,40 +134,37 @@ async def sso_callback(
 # Local login
 # ---------------------------------------------------------------------------
 @app.post("/api/auth/login")
-async def local_login(request: Request):
+async def local_login(body: LoginIn):
     """Local login with username + password."""
-    data = await request.json()
-    username = (data.get("username") or "").strip()
-    password = data.get("password", "")
-
-    if not username or not password:
-        raise HTTPException(400, "Username and password are required")
+    username = body.username
+    password = body.password
 
-    pw_hash = hash_password(password)
     user_id = f"local_{username.lower().replace(' ', '_')}"
 
-    conn = get_db()
-    user = conn.execute(
-        "SELECT * FROM users WHERE (user_id = ? OR user_name = ?) AND sso_token = ?",
-        (user_id, username, pw_hash),
-    ).fetchone()
-    conn.close()
+    rows = await db_fetchall(
+        """SELECT * FROM users WHERE user_id = ?
+           UNION ALL
+           SELECT * FROM users WHERE user_name = ? AND user_id != ?""",
+        (user_id, username, user_id),
+    )
+    user = None
+    for row in rows:
+        if await asyncio.to_thread(verify_password, row["sso_token"], password):
+            user = row
+            break
 
     if not user:
         raise HTTPException(401, "Invalid username or password")
 
-    jwt_token = create_jwt(user["user_id"], user["user_name"], user["role"])
-    response = JSONResponse(
+    if password_needs_rehash(user["sso_token"]):
+        pw_hash = await asyncio.to_thread(hash_password, password)
+        await db_run(set_password_hash, user["user_id"], pw_hash)
+
+    jwt_token = create_jwt(user["user_id"], user["role"])
+    response = ORJSONResponse(
         {"user_id": user["user_id"], "user_name": user["user_name"], "redirect": "/"}
     )
-    response.set_cookie(
-        "sci_token",
-        jwt_token,
-        httponly=True,
-        samesite="lax",
-        max_age=60 * 60 * 24 * 7,
-        path="/",
-    )
+    _attach_session_cookie(response, jwt_token)
     return response
 
 
@@ -132,47 +172,24 @@ async def local_login(request: Request):
 # Local registration
 # ---------------------------------------------------------------------------
 @app.post("/api/auth/register")
-async def local_register(request: Request):
+async def local_register(body: RegisterIn):
     """Register a local account."""
-    data = await request.json()
-    username = (data.get("username") or "").strip()
-    password = data.get("password", "")
+    username = body.username
+    password = body.password
 
-    if not username or not password:
-        raise HTTPException(400, "Username and password are required")
-    if len(password) < 8:
-        raise HTTPException(400, "Password must be at least 8 characters")
-
-    pw_hash = hash_password(password)
     user_id = f"local_{username.lower().replace(' ', '_')}"
+    pw_hash = await asyncio.to_thread(hash_password, password)
 
-    conn = get_db()
-    existing = conn.execute(
-        "SELECT user_id FROM users WHERE user_id = ? OR user_name = ?",
-        (user_id, username),
-    ).fetchone()
-    if existing:
-        conn.close()
+    try:
+        await db_run(create_local_user, user_id, username, pw_hash)
+    except sqlite3.IntegrityError:
         raise HTTPException(400, "Username already taken")
-    conn.close()
 
-    upsert_user(
-        {"user_id": user_id, "user_name": username, "role": "user"},
-        sso_token=pw_hash,
-    )
-
-    jwt_token = create_jwt(user_id, username, "user")
-    response = JSONResponse(
+    jwt_token = create_jwt(user_id, "user")
+    response = ORJSONResponse(
         {"user_id": user_id, "user_name": username, "status": "registered", "redirect": "/"}
     )
-    response.set_cookie(
-        "sci_token",
-        jwt_token,
-        httponly=True,
-        samesite="lax",
-        max_age=60 * 60 * 24 * 7,
-        path="/",
-    )
+    _attach_session_cookie(response, jwt_token)
     return response
 
 
@@ -180,12 +197,9 @@ async def local_register(request: Request):
 # Current user info
 # ---------------------------------------------------------------------------
 @app.get("/api/auth/me")
-async def auth_me(request: Request):
+async def auth_me(user: dict = Depends(get_current_user)):
     """Return current user info or 401."""
-    from auth import get_current_user
-
-    user = await get_current_user(request)
-    return JSONResponse(
+    return ORJSONResponse(
         {
             "user_id": user["user_id"],
             "user_name": user["user_name"],
@@ -198,8 +212,11 @@ async def auth_me(request: Request):
 # Logout
 # ---------------------------------------------------------------------------
 @app.get("/api/auth/logout")
-async def logout():
+async def logout(request: Request):
     """Clear session cookie and redirect to login."""
+    token = request.cookies.get("sci_token")
+    if token:
+        invalidate_jwt(token)
     response = RedirectResponse("/login")
     response.delete_cookie("sci_token", path="/")
     return response
@@ -2,13 +2,21 @@
 
 import os
 import time
+import base64
 import logging
 import hashlib
+import hmac
+import urllib.parse
+from collections import OrderedDict
 
-import jwt
 import httpx
+import orjson
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
 from fastapi import HTTPException, Request
 
+from database import db_run, get_user
+
 logger = logging.getLogger(__name__)
 
 # ---------------------------------------------------------------------------
@@ -17,6 +25,8 @@ logger = logging.getLogger(__name__)
 JWT_SECRET = os.environ.get("JWT_SECRET", "sci_jwt_s3cr3t_k3y_ch4ng3_m3")
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRY = 60 * 60 * 24 * 7  # 7 days
+JWT_CACHE_SIZE = 4096
+JWT_CACHE_TTL = 60  # seconds a verified token + DB record is reused
 
 # ---------------------------------------------------------------------------
 # SSO config (CompareGPT)
@@ -26,33 +36,103 @@ SSO_VALIDATE_URL = "https://auth.comparegpt.io/sso/validate"
 SSO_CALLBACK_URL = os.environ.get(
     "SSO_CALLBACK_URL", "https://sci.platformai.org/sso/callback"
 )
+SSO_LOGIN_URL = f"{SSO_REDIRECT_URL}?redirect={urllib.parse.quote(SSO_CALLBACK_URL)}"
+
+# Shared client so SSO callbacks reuse the connection to auth.comparegpt.io
+_sso_client = httpx.AsyncClient(
+    timeout=15,
+    http2=True,
+    limits=httpx.Limits(max_keepalive_connections=20, keepalive_expiry=60),
+)
 
 
 # ---------------------------------------------------------------------------
 # JWT helpers
 # ---------------------------------------------------------------------------
-def create_jwt(user_id: str, user_name: str = "", role: str = "user") -> str:
-    """Create a JWT token for a user."""
+def _b64url_encode(data: bytes) -> bytes:
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+
+def _b64url_decode(segment: bytes) -> bytes:
+    return base64.urlsafe_b64decode(segment + b"=" * (-len(segment) % 4))
+
+
+_JWT_SECRET_BYTES = JWT_SECRET.encode()
+_JWT_HEADER = _b64url_encode(orjson.dumps({"alg": JWT_ALGORITHM, "typ": "JWT"}))
+# HMAC state with the key already absorbed; copied for each signature
+_HMAC_TEMPLATE = hmac.new(_JWT_SECRET_BYTES, None, hashlib.sha256)
+
+
+def _sign(signing_input: bytes) -> bytes:
+    h = _HMAC_TEMPLATE.copy()
+    h.update(signing_input)
+    return _b64url_encode(h.digest())
+
+
+def create_jwt(user_id: str, role: str = "user") -> str:
+    """Create an HS256 JWT token for a user.
+
+    The user name is not embedded; it is read from the DB record instead.
+    """
+    now = int(time.time())
     payload = {
         "sub": user_id,
-        "name": user_name,
         "role": role,
-        "iat": int(time.time()),
-        "exp": int(time.time()) + JWT_EXPIRY,
+        "iat": now,
+        "exp": now + JWT_EXPIRY,
     }
-    return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
+    signing_input = _JWT_HEADER + b"." + _b64url_encode(orjson.dumps(payload))
+    return (signing_input + b"." + _sign(signing_input)).decode()
 
 
 def verify_jwt(token: str) -> dict | None:
-    """Verify and decode a JWT token. Returns payload dict or None."""
+    """Verify and decode an HS256 JWT token. Returns payload dict or None."""
     try:
-        return jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-    except jwt.ExpiredSignatureError:
+        signing_input, _, signature = token.encode().rpartition(b".")
+        header, _, body = signing_input.partition(b".")
+        if not hmac.compare_digest(_sign(signing_input), signature):
+            raise ValueError("Signature verification failed")
+        header_data = orjson.loads(_b64url_decode(header))
+        if not isinstance(header_data, dict) or header_data.get("alg") != JWT_ALGORITHM:
+            raise ValueError("Unsupported algorithm")
+        payload = orjson.loads(_b64url_decode(body))
+        if not isinstance(payload, dict) or not isinstance(payload.get("exp"), int):
+            raise ValueError("Missing exp claim")
+    except ValueError as e:
+        logger.warning(f"Invalid JWT: {e}")
+        return None
+    if payload["exp"] < time.time():
         logger.warning("JWT expired")
         return None
-    except jwt.InvalidTokenError as e:
-        logger.warning(f"Invalid JWT: {e}")
+    return payload
+
+
+# Verified tokens -> (cache expiry, payload, db_user), least recently used first
+_jwt_cache: OrderedDict[str, tuple[float, dict, dict | None]] = OrderedDict()
+
+
+def _jwt_cache_get(token: str) -> tuple[float, dict, dict | None] | None:
+    hit = _jwt_cache.get(token)
+    if hit is None:
+        return None
+    if hit[0] <= time.time():
+        del _jwt_cache[token]
         return None
+    _jwt_cache.move_to_end(token)
+    return hit
+
+
+def _jwt_cache_put(token: str, payload: dict, db_user: dict | None):
+    expires = min(payload["exp"], time.time() + JWT_CACHE_TTL)
+    _jwt_cache[token] = (expires, payload, db_user)
+    _jwt_cache.move_to_end(token)
+    if len(_jwt_cache) > JWT_CACHE_SIZE:
+        _jwt_cache.popitem(last=False)
+
+
+def invalidate_jwt(token: str):
+    """Drop a token from the verification cache (e.g. on logout)."""
+    _jwt_cache.pop(token, None)
 
 
 def _extract_jwt_from_request(request: Request) -> str | None:
@@ -75,46 +155,81 @@ async def exchange_sso_token(sso_token: str) -> dict | None:
     Returns user info dict or None on failure.
     """
     try:
-        async with httpx.AsyncClient(timeout=15) as client:
-            resp = await client.post(
-                SSO_VALIDATE_URL,
-                headers={"Authorization": f"Bearer {sso_token}"},
+        resp = await _sso_client.post(
+            SSO_VALIDATE_URL,
+            headers={"Authorization": f"Bearer {sso_token}"},
+        )
+        logger.info(f"SSO validate response: {resp.status_code}")
+        if resp.status_code != 200:
+            logger.error(
+                f"SSO validate failed: {resp.status_code} {resp.text}"
             )
-            logger.info(f"SSO validate response: {resp.status_code}")
-            if resp.status_code == 200:
-                body = resp.json()
-                data = body.get("data") or body
-                user_info = data.get("user_info") or data
-                balance = data.get("balance") or {}
-                return {
-                    "user_id": str(
-                        user_info.get("user_id", user_info.get("id", ""))
-                    ),
-                    "user_name": user_info.get(
-                        "user_name", user_info.get("name", "")
-                    ),
-                    "api_key": data.get(
-                        "api_key", user_info.get("api_key", "")
-                    ),
-                    "credit": balance.get("credit", data.get("credit", 0)),
-                    "token": balance.get("token", data.get("token", 0)),
-                    "role": user_info.get("role", "user"),
-                }
-            else:
-                logger.error(
-                    f"SSO validate failed: {resp.status_code} {resp.text}"
-                )
-                return None
+            return None
+        body = orjson.loads(resp.content)
+        data = body.get("data") or body
+        user_info = data.get("user_info") or data
+        balance = data.get("balance") or {}
+        return {
+            "user_id": str(
+                user_info.get("user_id", user_info.get("id", ""))
+            ),
+            "user_name": user_info.get(
+                "user_name", user_info.get("name", "")
+            ),
+            "api_key": data.get(
+                "api_key", user_info.get("api_key", "")
+            ),
+            "credit": balance.get("credit", data.get("credit", 0)),
+            "token": balance.get("token", data.get("token", 0)),
+            "role": user_info.get("role", "user"),
+        }
     except Exception as e:
         logger.error(f"SSO exchange error: {e}")
         return None
 
 
+async def close_sso_client():
+    """Close the shared SSO HTTP client."""
+    await _sso_client.aclose()
+
+
 # ---------------------------------------------------------------------------
 # Password hashing
 # ---------------------------------------------------------------------------
+_password_hasher = PasswordHasher(time_cost=2, memory_cost=64 * 1024, parallelism=1)
+
+
 def hash_password(password: str) -> str:
-    return hashlib.sha256(password.encode()).hexdigest()
+    """Hash a password with argon2id. The salt is embedded in the result."""
+    return _password_hasher.hash(password)
+
+
+def _is_legacy_hash(pw_hash: str) -> bool:
+    return not pw_hash.startswith("$argon2")
+
+
+def verify_password(pw_hash: str, password: str) -> bool:
+    """Check a password against a stored hash.
+
+    Unsalted SHA-256 hex digests from older accounts are still accepted so
+    they can be upgraded on the next successful login.
+    """
+    if not pw_hash:
+        return False
+    if _is_legacy_hash(pw_hash):
+        legacy = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(legacy, pw_hash)
+    try:
+        return _password_hasher.verify(pw_hash, password)
+    except (VerificationError, InvalidHashError):
+        return False
+
+
+def password_needs_rehash(pw_hash: str) -> bool:
+    """True if a stored hash is legacy or uses outdated argon2 parameters."""
+    if _is_legacy_hash(pw_hash):
+        return True
+    return _password_hasher.check_needs_rehash(pw_hash)
 
 
 # ---------------------------------------------------------------------------
@@ -124,40 +239,44 @@ def _build_user_dict(payload: dict, db_user: dict | None) -> dict:
     """Build user context dict from JWT payload and optional DB record."""
     user = {
         "user_id": payload["sub"],
-        "user_name": payload.get("name", ""),
+        "user_name": "",
         "role": payload.get("role", "user"),
     }
     if db_user:
-        user["user_name"] = db_user.get("user_name") or user["user_name"]
+        user["user_name"] = db_user.get("user_name") or ""
         user["role"] = db_user.get("role") or user["role"]
         user["credit"] = db_user.get("credit", 0)
         user["token"] = db_user.get("token", 0)
     return user
 
 
+async def _authenticate(token: str) -> dict | None:
+    """Resolve a token to a user dict, using the verification cache."""
+    hit = _jwt_cache_get(token)
+    if hit:
+        return _build_user_dict(hit[1], hit[2])
+    payload = verify_jwt(token)
+    if not payload:
+        return None
+    db_user = await db_run(get_user, payload["sub"])
+    _jwt_cache_put(token, payload, db_user)
+    return _build_user_dict(payload, db_user)
+
+
 async def get_current_user(request: Request) -> dict:
     """FastAPI dependency — requires authentication. Raises 401."""
-    from database import get_user
-
     token = _extract_jwt_from_request(request)
     if not token:
         raise HTTPException(status_code=401, detail="Not authenticated")
-    payload = verify_jwt(token)
-    if not payload:
+    user = await _authenticate(token)
+    if not user:
         raise HTTPException(status_code=401, detail="Invalid or expired token")
-    db_user = get_user(payload["sub"])
-    return _build_user_dict(payload, db_user)
+    return user
 
 
 async def get_optional_user(request: Request) -> dict | None:
     """FastAPI dependency — returns user dict if authenticated, None otherwise."""
-    from database import get_user
-
     token = _extract_jwt_from_request(request)
     if not token:
         return None
-    payload = verify_jwt(token)
-    if not payload:
-        return None
-    db_user = get_user(payload["sub"])
-    return _build_user_dict(payload, db_user)
+    return await _authenticate(token)
@@ -1,7 +1,11 @@
 """SQLite database for sci.platformai.org user management."""
 
+import asyncio
 import os
+import queue
 import sqlite3
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 
 DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
@@ -20,54 +24,150 @@ CREATE TABLE IF NOT EXISTS users (
     created_at  TEXT NOT NULL,
     updated_at  TEXT NOT NULL
 );
+
+CREATE INDEX IF NOT EXISTS idx_users_user_name ON users(user_name);
 """
 
 
-def get_db() -> sqlite3.Connection:
-    """Return a new database connection with row_factory set."""
-    os.makedirs(DATA_DIR, exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA journal_mode=WAL")
-    return conn
+POOL_SIZE = 8
+
+PRAGMAS = """
+PRAGMA journal_mode=WAL;
+PRAGMA synchronous=NORMAL;
+PRAGMA temp_store=memory;
+PRAGMA cache_size=-64000;
+"""
+
+
+class _ConnectionPool:
+    """Fixed-size pool of long-lived SQLite connections.
+
+    Connections are opened lazily up to ``size`` and kept for the life of the
+    process so the PRAGMA setup and SQLite's page cache survive across requests.
+    """
+
+    def __init__(self, size: int = POOL_SIZE):
+        self._size = size
+        self._idle: queue.Queue[sqlite3.Connection] = queue.Queue(maxsize=size)
+        self._lock = threading.Lock()
+        self._opened = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        os.makedirs(DATA_DIR, exist_ok=True)
+        conn = sqlite3.connect(
+            DB_PATH, check_same_thread=False, isolation_level=None
+        )
+        conn.row_factory = sqlite3.Row
+        conn.executescript(PRAGMAS)
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._opened < self._size:
+                conn = self._connect()
+                self._opened += 1
+                return conn
+        return self._idle.get()
+
+    def release(self, conn: sqlite3.Connection):
+        self._idle.put(conn)
+
+    def warmup(self):
+        """Open every connection up front."""
+        conns = [self.acquire() for _ in range(self._size)]
+        for conn in conns:
+            self.release(conn)
+
+    def close_all(self):
+        """Close all idle connections."""
+        with self._lock:
+            while True:
+                try:
+                    conn = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                conn.close()
+                self._opened -= 1
+
+
+_pool = _ConnectionPool()
+
+
+@contextmanager
+def get_db():
+    """Borrow a pooled connection (autocommit, row_factory set)."""
+    conn = _pool.acquire()
+    try:
+        yield conn
+    finally:
+        _pool.release(conn)
+
+
+def open_pool():
+    """Open all pooled connections."""
+    _pool.warmup()
+
+
+def close_pool():
+    """Close all pooled connections."""
+    _pool.close_all()
+
+
+def _fetchone(sql: str, params: tuple) -> sqlite3.Row | None:
+    with get_db() as conn:
+        return conn.execute(sql, params).fetchone()
+
+
+def _fetchall(sql: str, params: tuple) -> list[sqlite3.Row]:
+    with get_db() as conn:
+        return conn.execute(sql, params).fetchall()
+
+
+async def db_fetchone(sql: str, params: tuple = ()) -> sqlite3.Row | None:
+    """Run a single-row query in a worker thread."""
+    return await asyncio.to_thread(_fetchone, sql, params)
+
+
+async def db_fetchall(sql: str, params: tuple = ()) -> list[sqlite3.Row]:
+    """Run a multi-row query in a worker thread."""
+    return await asyncio.to_thread(_fetchall, sql, params)
+
+
+async def db_run(fn, *args):
+    """Run a blocking database function in a worker thread."""
+    return await asyncio.to_thread(fn, *args)
 
 
 def init_db():
     """Create tables if they don't exist."""
-    conn = get_db()
-    conn.executescript(SCHEMA)
-    conn.commit()
-    conn.close()
+    with get_db() as conn:
+        conn.executescript(SCHEMA)
+
+
+_UPSERT_USER_SQL = """
+INSERT INTO users
+    (user_id, user_name, role, credit, token, sso_token, api_key, created_at, updated_at)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(user_id) DO UPDATE SET
+    user_name=excluded.user_name,
+    sso_token=excluded.sso_token,
+    api_key=excluded.api_key,
+    credit=excluded.credit,
+    token=excluded.token,
+    updated_at=excluded.updated_at
+"""
 
 
 def upsert_user(user_info: dict, sso_token: str = "") -> dict:
     """Insert or update a user record. Returns the user dict."""
     now = datetime.utcnow().isoformat()
-    conn = get_db()
-    existing = conn.execute(
-        "SELECT * FROM users WHERE user_id = ?", (user_info["user_id"],)
-    ).fetchone()
-
-    if existing:
+    with get_db() as conn:
         conn.execute(
-            """UPDATE users
-               SET user_name=?, sso_token=?, api_key=?, credit=?, token=?, updated_at=?
-               WHERE user_id=?""",
-            (
-                user_info.get("user_name", ""),
-                sso_token,
-                user_info.get("api_key", ""),
-                user_info.get("credit", 0),
-                user_info.get("token", 0),
-                now,
-                user_info["user_id"],
-            ),
-        )
-    else:
-        conn.execute(
-            """INSERT INTO users
-               (user_id, user_name, role, credit, token, sso_token, api_key, created_at, updated_at)
-               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            _UPSERT_USER_SQL,
             (
                 user_info["user_id"],
                 user_info.get("user_name", ""),
@@ -80,18 +180,58 @@ def upsert_user(user_info: dict, sso_token: str = "") -> dict:
                 now,
             ),
         )
-    conn.commit()
-    conn.close()
     return user_info
 
 
+def create_local_user(user_id: str, user_name: str, pw_hash: str):
+    """Create a local account atomically.
+
+    Raises sqlite3.IntegrityError if the user_id or user_name is taken.
+    """
+    now = datetime.utcnow().isoformat()
+    with get_db() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            taken = conn.execute(
+                "SELECT 1 FROM users WHERE user_id = ? OR user_name = ?",
+                (user_id, user_name),
+            ).fetchone()
+            if taken:
+                raise sqlite3.IntegrityError("Username already taken")
+            conn.execute(
+                """INSERT INTO users
+                   (user_id, user_name, role, sso_token, created_at, updated_at)
+                   VALUES (?, ?, 'user', ?, ?, ?)""",
+                (user_id, user_name, pw_hash, now, now),
+            )
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+
+def set_password_hash(user_id: str, pw_hash: str):
+    """Replace the stored password hash of a local account."""
+    now = datetime.utcnow().isoformat()
+    with get_db() as conn:
+        conn.execute(
+            "UPDATE users SET sso_token=?, updated_at=? WHERE user_id=?",
+            (pw_hash, now, user_id),
+        )
+
+
 def get_user(user_id: str) -> dict | None:
-    """Fetch a user by user_id. Returns dict or None."""
-    conn = get_db()
-    row = conn.execute(
-        "SELECT * FROM users WHERE user_id = ?", (user_id,)
-    ).fetchone()
-    conn.close()
+    """Fetch the profile fields of a user by user_id. Returns dict or None."""
+    with get_db() as conn:
+        row = conn.execute(
+            "SELECT user_name, role, credit, token FROM users WHERE user_id = ?",
+            (user_id,),
+        ).fetchone()
     if row:
-        return dict(row)
+        return {
+            "user_name": row[0],
+            "role": row[1],
+            "credit": row[2],
+            "token": row[3],
+        }
     return None
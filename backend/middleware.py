@@ -0,0 +1,79 @@
+"""Pure ASGI middleware for sci.platformai.org."""
+
+ALLOWED_ORIGIN = b"https://sci.platformai.org"
+
+_PREFLIGHT_HEADERS = (
+    (b"access-control-allow-origin", ALLOWED_ORIGIN),
+    (b"access-control-allow-credentials", b"true"),
+    (b"access-control-allow-methods", b"DELETE, GET, HEAD, OPTIONS, PATCH, POST, PUT"),
+    (b"access-control-max-age", b"600"),
+    (b"vary", b"Origin"),
+    (b"content-type", b"text/plain; charset=utf-8"),
+)
+
+_SIMPLE_HEADERS = (
+    (b"access-control-allow-origin", ALLOWED_ORIGIN),
+    (b"access-control-allow-credentials", b"true"),
+    (b"vary", b"Origin"),
+)
+
+
+class SciCORS:
+    """CORS for the single origin this app serves.
+
+    Equivalent to Starlette's CORSMiddleware configured with one allowed
+    origin, credentials, and all methods/headers, without its per-request
+    generic header handling.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        origin = None
+        request_method = None
+        request_headers = None
+        for name, value in scope["headers"]:
+            if name == b"origin":
+                origin = value
+            elif name == b"access-control-request-method":
+                request_method = value
+            elif name == b"access-control-request-headers":
+                request_headers = value
+
+        if origin is None:
+            await self.app(scope, receive, send)
+            return
+
+        if scope["method"] == "OPTIONS" and request_method is not None:
+            await self._preflight(origin, request_headers, send)
+            return
+
+        if origin != ALLOWED_ORIGIN:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", ()), *_SIMPLE_HEADERS]
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+    @staticmethod
+    async def _preflight(origin: bytes, request_headers: bytes | None, send):
+        if origin == ALLOWED_ORIGIN:
+            status, body = 200, b"OK"
+            headers = list(_PREFLIGHT_HEADERS)
+            if request_headers:
+                headers.append((b"access-control-allow-headers", request_headers))
+        else:
+            status, body = 400, b"Disallowed CORS origin"
+            headers = [(b"content-type", b"text/plain; charset=utf-8")]
+        headers.append((b"content-length", str(len(body)).encode()))
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})